@@ -1,5 +1,6 @@
 """AnkiConnect API client for Anki Helpers."""
 
+from operator import itemgetter
 from typing import Any, Dict, List
 
 import requests
@@ -11,6 +12,67 @@ class AnkiConnectError(Exception):
     pass
 
 
+API_VERSION = 6
+
+DUE_WINDOW_DAYS = 30
+
+
+def _action(action: str, **params) -> Dict[str, Any]:
+    """Build an AnkiConnect action for use with the multi action.
+
+    Args:
+        action: The AnkiConnect action to invoke.
+        **params: Additional parameters for the action.
+
+    Returns:
+        The action in the format expected by AnkiConnect.
+    """
+    return {"action": action, "version": API_VERSION, "params": params}
+
+
+def _due_offset_queries() -> List[str]:
+    """Build the queries needed to find the due offsets of red flag cards.
+
+    AnkiConnect does not expose the collection's current day number, so
+    the day offset can't be derived from the ``due`` field of cardsInfo.
+    Instead, the first query selects the cards due in the next
+    DUE_WINDOW_DAYS days and each following query selects the cards whose
+    day offset has one bit set, which takes log2(DUE_WINDOW_DAYS) queries
+    instead of one query per day.
+
+    Returns:
+        The findCards queries, to be decoded with ``_decode_due_offsets``.
+    """
+    queries = [f"flag:1 prop:due>=0 prop:due<{DUE_WINDOW_DAYS}"]
+    bit = 1
+    while bit < DUE_WINDOW_DAYS:
+        days = " OR ".join(
+            f"prop:due={day}" for day in range(DUE_WINDOW_DAYS) if day & bit
+        )
+        queries.append(f"flag:1 ({days})")
+        bit <<= 1
+    return queries
+
+
+def _decode_due_offsets(results: List[List[int]]) -> Dict[int, int]:
+    """Decode the results of the queries built by ``_due_offset_queries``.
+
+    Args:
+        results: The card IDs found by each query, in order.
+
+    Returns:
+        A dictionary mapping card IDs to the number of days until they
+        are due.
+    """
+    window, *bits = results
+    offsets = dict.fromkeys(window, 0)
+    for bit, card_ids in enumerate(bits):
+        for card_id in card_ids:
+            if card_id in offsets:
+                offsets[card_id] |= 1 << bit
+    return offsets
+
+
 class AnkiConnect:
     """Client for interacting with AnkiConnect API."""
 
@@ -22,6 +84,8 @@ class AnkiConnect:
                 Defaults to localhost:8765.
         """
         self.url = url
+        # Reuse one connection for all actions instead of reconnecting each time
+        self._session = requests.Session()
 
     def _invoke(self, action: str, **params) -> Any:
         """Invoke an AnkiConnect action.
@@ -38,9 +102,7 @@ class AnkiConnect:
                 an error.
         """
         try:
-            response = requests.post(
-                self.url, json={"action": action, "version": 6, "params": params}
-            )
+            response = self._session.post(self.url, json=_action(action, **params))
             response.raise_for_status()
             result = response.json()
 
@@ -53,6 +115,58 @@ class AnkiConnect:
             msg = f"Failed to connect to AnkiConnect: {str(e)}"
             raise AnkiConnectError(msg)
 
+    def _invoke_multi(self, actions: List[Dict[str, Any]]) -> List[Any]:
+        """Invoke several AnkiConnect actions in a single request.
+
+        The actions run one after another inside Anki, which handles a single
+        request at a time, so batching them is cheaper than sending them
+        concurrently.
+
+        Args:
+            actions: The actions to invoke, as built by ``_action``.
+
+        Returns:
+            The result of each action, in order.
+
+        Raises:
+            AnkiConnectError: If the request fails or any of the actions
+                returns an error.
+        """
+        results = []
+        for reply in self._invoke("multi", actions=actions):
+            if reply.get("error"):
+                msg = f"AnkiConnect error: {reply['error']}"
+                raise AnkiConnectError(msg)
+            results.append(reply.get("result"))
+        return results
+
+    def _find_red_flag_note_ids(self) -> List[int]:
+        """Find the IDs of all notes that have a red flag.
+
+        Returns:
+            A list of note IDs.
+        """
+        return self._invoke("findNotes", query="flag:1")
+
+    def _card_ids(self, notes_info: List[Dict[str, Any]]) -> List[int]:
+        """Collect the card IDs of the given notes.
+
+        The IDs are taken from the cards field of notesInfo. Older AnkiConnect
+        releases don't report that field, in which case the cards are looked
+        up with an nid: findCards query instead.
+
+        Args:
+            notes_info: Notes as returned by the notesInfo action.
+
+        Returns:
+            The IDs of all cards of these notes.
+        """
+        if all("cards" in note for note in notes_info):
+            return [card_id for note in notes_info for card_id in note["cards"]]
+
+        note_ids = ",".join(str(note["noteId"]) for note in notes_info)
+        return self._invoke("findCards", query=f"nid:{note_ids}")
+
     def get_deck_names(self) -> List[str]:
         """Get a list of all deck names.
 
@@ -71,41 +185,33 @@ class AnkiConnect:
             The dueQuery field indicates if the card is due (0) or not (-1).
         """
         # First, find all note IDs with red flags
-        query = "flag:1"
-        note_ids = self._invoke("findNotes", query=query)
+        note_ids = self._find_red_flag_note_ids()
 
         if not note_ids:
             return []
 
-        # Find all card IDs for these notes
-        card_ids = self._invoke(
-            "findCards", query=f"nid:{','.join(map(str, note_ids))}"
-        )
+        # Get note info, which includes the card IDs of each note
+        notes_info = self._invoke("notesInfo", notes=note_ids)
+        card_ids = self._card_ids(notes_info)
 
         if not card_ids:
             return []
 
-        # Get note info to include content
-        notes_info = self._invoke("notesInfo", notes=note_ids)
-
         return notes_info
 
-    def get_intervals(self, card_ids: List[int]) -> Dict[int, int]:
+    def get_intervals(self, card_ids: List[int]) -> List[int]:
         """Get intervals for the specified cards.
 
         Args:
             card_ids: List of card IDs to get intervals for.
 
         Returns:
-            A dictionary mapping card IDs to their intervals.
+            A list of intervals, in the same order as card_ids.
         """
         if not card_ids:
-            return {}
-
-        intervals = self._invoke("getIntervals", cards=card_ids)
+            return []
 
-        # Create a dictionary mapping card IDs to their intervals
-        return {card_id: interval for card_id, interval in zip(card_ids, intervals)}
+        return self._invoke("getIntervals", cards=card_ids)
 
     def find_cards_with_red_flag(self) -> List[Dict[str, Any]]:
         """Find all cards that have a red flag and include due date information.
@@ -114,41 +220,30 @@ class AnkiConnect:
             A list of cards with red flags, including their content and due date.
         """
         # First, find all note IDs with red flags
-        query = "flag:1"
-        note_ids = self._invoke("findNotes", query=query)
+        note_ids = self._find_red_flag_note_ids()
 
         if not note_ids:
             return []
 
-        # Find all card IDs for these notes
-        card_ids = self._invoke(
-            "findCards", query=f"nid:{','.join(map(str, note_ids))}"
-        )
+        # Get note info, which includes the card IDs of each note
+        notes_info = self._invoke("notesInfo", notes=note_ids)
+        card_ids = self._card_ids(notes_info)
 
         if not card_ids:
             return []
 
-        # Get card info including due date
+        # Get card info including due date and interval
         cards_info = self._invoke("cardsInfo", cards=card_ids)
 
-        # Get intervals for these cards
-        intervals = self.get_intervals(card_ids)
+        # cardsInfo includes the note fields but not the note tags
+        tags_by_note = {note["noteId"]: note.get("tags", []) for note in notes_info}
 
-        # Get note info to include content
-        notes_info = self._invoke("notesInfo", notes=note_ids)
-
-        # Create a dictionary to quickly look up notes by ID
-        notes_by_id = {note["noteId"]: note for note in notes_info}
-
-        # Combine card info with note content and intervals
+        # Combine card info with note content
         for card in cards_info:
             note_id = card.get("note")
-            card_id = card.get("cardId")
-            if note_id in notes_by_id:
-                card["noteFields"] = notes_by_id[note_id].get("fields", {})
-                card["noteTags"] = notes_by_id[note_id].get("tags", [])
-            if card_id in intervals:
-                card["interval"] = intervals[card_id]
+            card["noteFields"] = card.get("fields", {})
+            if note_id in tags_by_note:
+                card["noteTags"] = tags_by_note[note_id]
 
         return cards_info
 
@@ -156,75 +251,77 @@ class AnkiConnect:
         """Find all cards that have a red flag and include due date information with sorting.
 
         Returns:
-            A list of cards with red flags, including their content, due date, and dueQuery field.
-            The dueQuery field indicates if the card is due (0) or not (-1).
+            A list of cards with red flags, including their content, due date, and dueQuery field,
+            sorted by dueQuery so that the cards due soonest come first.
+            The dueQuery field is the number of days until the card is due, -1 if it is overdue,
+            -2 if it is overdue by a week or more and 90 if it is not due in the next 30 days.
         """
         # First, find all note IDs with red flags
-        query = "flag:1"
-        note_ids = self._invoke("findNotes", query=query)
+        note_ids = self._find_red_flag_note_ids()
 
         if not note_ids:
             return []
 
-        # Find all card IDs for these notes
-        card_ids = self._invoke(
-            "findCards", query=f"nid:{','.join(map(str, note_ids))}"
+        # Get the note info, which includes the card IDs of each note, and
+        # the due buckets in a single request
+        due_offset_queries = _due_offset_queries()
+        notes_info, due_note_ids, overdue_note_ids, *due_offset_results = (
+            self._invoke_multi(
+                [
+                    _action("notesInfo", notes=note_ids),
+                    _action("findNotes", query="flag:1 prop:due<0 prop:due>-7"),
+                    _action("findNotes", query="flag:1 prop:due<-6"),
+                    *[_action("findCards", query=q) for q in due_offset_queries],
+                ]
+            )
         )
+        card_ids = self._card_ids(notes_info)
 
         if not card_ids:
             return []
 
-        # Get card info including due date
+        # Get card info including due date and interval
         cards_info = self._invoke("cardsInfo", cards=card_ids)
 
-        # Get intervals for these cards
-        intervals = self.get_intervals(card_ids)
-
-        # Get note info to include content
-        notes_info = self._invoke("notesInfo", notes=note_ids)
-
-        # Create dictionaries to quickly look up notes by ID
-        notes_by_id = {note["noteId"]: note for note in notes_info}
-
-        # Default dueQuery value for all notes
+        # Index notes by ID, with the default dueQuery value for all notes
+        notes_by_id = {}
         for note in notes_info:
             note["dueQuery"] = 90
-
-        query = "flag:1 prop:due<0 prop:due>-7"
-        due_note_ids = self._invoke("findNotes", query=query)
+            notes_by_id[note["noteId"]] = note
 
         # Update dueQuery for due notes
-        for note in notes_info:
-            if note["noteId"] in due_note_ids:
-                note["dueQuery"] = -1
-        query = "flag:1 prop:due<-6"
-        due_note_ids = self._invoke("findNotes", query=query)
+        for note_id in due_note_ids:
+            if note_id in notes_by_id:
+                notes_by_id[note_id]["dueQuery"] = -1
 
-        # Update dueQuery for due notes
-        for note in notes_info:
-            if note["noteId"] in due_note_ids:
-                note["dueQuery"] = -2
+        # Update dueQuery for overdue notes
+        for note_id in overdue_note_ids:
+            if note_id in notes_by_id:
+                notes_by_id[note_id]["dueQuery"] = -2
 
-        # Find all due notes with flag:1 for due days 0-14
-        for dueProp in range(30):  # 0 to 14
-            query = f"flag:1 prop:due={dueProp}"
-            due_note_ids = self._invoke("findNotes", query=query)
+        # Notes with a card due in the upcoming window take the latest offset
+        due_offsets = _decode_due_offsets(due_offset_results)
+        window_due: Dict[int, int] = {}
+        for card in cards_info:
+            offset = due_offsets.get(card.get("cardId"))
+            if offset is not None:
+                note_id = card.get("note")
+                window_due[note_id] = max(offset, window_due.get(note_id, offset))
 
-            # Update dueQuery for due notes
-            for note in notes_info:
-                if note["noteId"] in due_note_ids:
-                    note["dueQuery"] = dueProp
+        for note_id, offset in window_due.items():
+            if note_id in notes_by_id:
+                notes_by_id[note_id]["dueQuery"] = offset
 
-        # Combine card info with note content, intervals, and dueQuery
+        # Combine card info with note content and dueQuery.
+        # cardsInfo includes the note fields but not the note tags.
         for card in cards_info:
-            note_id = card.get("note")
-            card_id = card.get("cardId")
-            if note_id in notes_by_id:
-                card["noteFields"] = notes_by_id[note_id].get("fields", {})
-                card["noteTags"] = notes_by_id[note_id].get("tags", [])
-                # Add the dueQuery from the note to the card
-                card["dueQuery"] = notes_by_id[note_id].get("dueQuery", -1)
-            if card_id in intervals:
-                card["interval"] = intervals[card_id]
+            note = notes_by_id.get(card.get("note"), {})
+            card["noteFields"] = card.get("fields", {})
+            card["noteTags"] = note.get("tags", [])
+            # Add the dueQuery from the note to the card
+            card["dueQuery"] = note.get("dueQuery", 90)
+
+        # Sort cards by due date (ascending)
+        cards_info.sort(key=itemgetter("dueQuery"))
 
         return cards_info
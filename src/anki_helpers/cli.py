@@ -3,14 +3,16 @@
 import html
 import os
 import re
-import time
+from datetime import date, timedelta
 from pathlib import Path
 
 import click
-from openai import OpenAI
 
 from .anki_connect import AnkiConnect, AnkiConnectError
-from .prompts.examples_for_red_cards import get_prompt
+from .prompts.examples_for_red_cards import SYSTEM_MESSAGE, get_prompt
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_SOUND_RE = re.compile(r"\[sound:[^\]]+\]")
 
 
 # Manually load .env file
@@ -24,12 +26,15 @@ def load_dotenv():
     env_path = Path(".") / ".env"
     if env_path.exists():
         with open(env_path) as f:
-            for line in f:
-                if line.strip() and not line.startswith("#"):
-                    key, value = line.strip().split("=", 1)
-                    # Only set environment variable if it doesn't already exist
-                    if key.strip() not in os.environ:
-                        os.environ[key.strip()] = value.strip().strip("\"'")
+            for raw_line in f:
+                line = raw_line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                key, separator, value = line.partition("=")
+                if not separator:
+                    continue
+                # Only set environment variable if it doesn't already exist
+                os.environ.setdefault(key.strip(), value.strip().strip("\"'"))
 
 
 def clean_html_content(content: str) -> str:
@@ -41,22 +46,22 @@ def clean_html_content(content: str) -> str:
     Returns:
         Clean text suitable for terminal display
     """
-    # Replace &nbsp; with regular space
-    content = content.replace("&nbsp;", " ")
+    # Most fields are plain words with nothing to decode or strip
+    if "<" not in content and "&" not in content and "[" not in content:
+        return " ".join(content.split())
 
-    # Decode other HTML entities
+    # Decode HTML entities; &nbsp; becomes a non-breaking space, which is
+    # collapsed together with other whitespace below
     content = html.unescape(content)
 
     # Remove HTML tags
-    content = re.sub(r"<[^>]+>", "", content)
+    content = _TAG_RE.sub("", content)
 
     # Remove [sound:...] tags
-    content = re.sub(r"\[sound:[^\]]+\]", "", content)
-
-    # Clean up multiple spaces
-    content = " ".join(content.split())
+    content = _SOUND_RE.sub("", content)
 
-    return content.strip()
+    # Clean up multiple spaces, including leading and trailing ones
+    return " ".join(content.split())
 
 
 @click.group()
@@ -91,9 +96,9 @@ def list_deck():
             click.echo("No decks found.")
             return
 
+        decks.sort()
         click.echo("Available decks:")
-        for deck in sorted(decks):
-            click.echo(f"  • {deck}")
+        click.echo("\n".join(f"  • {deck}" for deck in decks))
 
     except AnkiConnectError as e:
         click.echo(f"Error: {str(e)}", err=True)
@@ -113,11 +118,10 @@ def list_red_flags(limit):
             click.echo("No cards with red flags found.")
             return
 
-        # Sort cards by due date (ascending)
-        sorted_cards = sorted(cards, key=lambda card: card.get("dueQuery", 0))
-
+        today = date.today()
         click.echo(f"Cards with red flags (sorted by due date, showing top {limit}):")
-        for card in sorted_cards[:limit]:
+        lines = []
+        for card in cards[:limit]:
             # Extract the front field (usually contains the word)
             fields = card.get("noteFields", {})
             front_field_name = next(iter(fields.keys()), None)
@@ -130,25 +134,22 @@ def list_red_flags(limit):
                 due_date = "N/A"
                 dueQuery = card.get("dueQuery", 90)
 
-                today_timestamp = time.time()
-                due_date_timestamp = today_timestamp + (
-                    dueQuery * 86400
-                )  # Convert days to seconds
                 try:
-                    due_date = time.strftime(
-                        "%Y-%m-%d", time.localtime(due_date_timestamp)
-                    )
+                    due_date = (today + timedelta(days=dueQuery)).isoformat()
                 except Exception as e:
                     # Log the error but continue processing
                     click.echo(f"Some error with formatting: {str(e)}", err=True)
                     due_date = "Error"
 
-                # Display the card information
-                click.echo(f"  • {front_content}")
-                click.echo(f"    Due: {due_date}")
+                # Collect the card information to display it in one write
+                lines.append(f"  • {front_content}")
+                lines.append(f"    Due: {due_date}")
                 if tags:
-                    click.echo(f"    Tags: {', '.join(tags)}")
-                click.echo("")
+                    lines.append(f"    Tags: {', '.join(tags)}")
+                lines.append("")
+
+        if lines:
+            click.echo("\n".join(lines))
 
     except AnkiConnectError as e:
         click.echo(f"Error: {str(e)}", err=True)
@@ -211,16 +212,14 @@ def get_examples_for_red_flags_cards(output_dir, limit):
                 words.append(front_content)
 
         # Create input-words.md file
+        words_content = "\n".join(words)
         input_file_path = output_path / "input-words.md"
         with open(input_file_path, "w") as f:
-            f.write("\n".join(words))
+            f.write(words_content)
 
         click.echo(f"Created input file with {len(words)} words at {input_file_path}")
 
         # Prepare prompt for OpenAI
-        with open(input_file_path, "r") as f:
-            words_content = f.read()
-
         prompt = get_prompt(words_content)
 
         model = "gpt-4o"
@@ -229,45 +228,42 @@ def get_examples_for_red_flags_cards(output_dir, limit):
         click.echo(f"- Model: {model}")
         click.echo(f"- Input words count: {len(words)}")
         click.echo(f"- Prompt length: {len(prompt)} characters")
-        click.echo(
-            "- System message: 'You are a helpful assistant for language learning.'"
-        )
+        click.echo(f"- System message: '{SYSTEM_MESSAGE}'")
 
         # Write prompt to a debug file
         debug_prompt_path = output_path / "debug-prompt.txt"
         with open(debug_prompt_path, "w") as f:
             f.write(f"MODEL: {model}\n\n")
-            f.write(
-                "SYSTEM MESSAGE:\nYou are a helpful assistant for language learning.\n\n"
-            )
+            f.write(f"SYSTEM MESSAGE:\n{SYSTEM_MESSAGE}\n\n")
             f.write(f"USER MESSAGE:\n{prompt}")
         click.echo(f"- Full prompt saved to: {debug_prompt_path}")
 
-        # Call OpenAI API
+        # Call OpenAI API. openai is imported here because loading it takes
+        # about half a second, which every other command would pay otherwise.
+        from openai import OpenAI
+
         client = OpenAI(api_key=api_key)
-        # create a system prompt as a variable and pass it here
         response = client.chat.completions.create(
             model=model,
             messages=[
-                {
-                    "role": "system",
-                    "content": "You are a helpful assistant for language learning.",
-                },
+                {"role": "system", "content": SYSTEM_MESSAGE},
                 {"role": "user", "content": prompt},
             ],
+            stream=True,
         )
 
-        # Get response content
-        response_content = response.choices[0].message.content
-
-        # Output to console
+        # Output the response to console and results.md as it arrives
         click.echo("\nOpenAI Response:")
-        click.echo(response_content)
-
-        # Save to results.md
         results_file_path = output_path / "results.md"
         with open(results_file_path, "w") as f:
-            f.write(response_content)
+            for chunk in response:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    click.echo(delta, nl=False)
+                    f.write(delta)
+        click.echo("")
 
         click.echo(f"\nResults saved to {results_file_path}")
 
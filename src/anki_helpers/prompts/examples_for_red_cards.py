@@ -1,5 +1,7 @@
 """Prompt templates for generating example sentences for red flagged cards."""
 
+SYSTEM_MESSAGE = "You are a helpful assistant for language learning."
+
 
 def get_prompt(words_content: str) -> str:
     """Generate prompt for getting example sentences for red flag cards.
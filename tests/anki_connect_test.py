@@ -0,0 +1,126 @@
+"""Tests for the AnkiConnect client."""
+
+import re
+
+from anki_helpers.anki_connect import AnkiConnect
+
+# Red flag cards as (card ID, note ID, days until due)
+CARDS = [
+    (11, 1, 0),
+    (12, 1, 3),
+    (21, 2, 29),
+    (31, 3, -2),
+    (41, 4, -10),
+    (51, 5, 45),
+    (61, 6, 13),
+]
+
+
+def _matches(query, offset):
+    """Check whether a card due in ``offset`` days matches a search query.
+
+    Args:
+        query: Anki search query using only ``prop:due`` conditions
+        offset: Number of days until the card is due
+
+    Returns:
+        True if the card matches the query
+    """
+    days = {int(day) for day in re.findall(r"prop:due=(-?\d+)", query)}
+    if days and offset not in days:
+        return False
+    for op, value in re.findall(r"prop:due(<|>=|>)(-?\d+)", query):
+        value = int(value)
+        if op == "<" and not offset < value:
+            return False
+        if op == ">" and not offset > value:
+            return False
+        if op == ">=" and not offset >= value:
+            return False
+    return True
+
+
+class FakeAnkiConnect(AnkiConnect):
+    """AnkiConnect client answering actions from the CARDS fixture."""
+
+    def __init__(self):
+        """Initialize the fake client with an empty query log."""
+        super().__init__()
+        self.queries = []
+        # Older AnkiConnect releases leave the cards field out of notesInfo
+        self.notes_info_cards = True
+
+    def _invoke(self, action, **params):
+        """Answer an AnkiConnect action without any HTTP request.
+
+        Args:
+            action: The AnkiConnect action to invoke.
+            **params: Additional parameters for the action.
+
+        Returns:
+            The response AnkiConnect would give for CARDS.
+        """
+        if action == "multi":
+            return [
+                {"result": self._invoke(a["action"], **a["params"]), "error": None}
+                for a in params["actions"]
+            ]
+        if action == "findNotes":
+            self.queries.append(params["query"])
+            return sorted({n for _, n, d in CARDS if _matches(params["query"], d)})
+        if action == "findCards":
+            self.queries.append(params["query"])
+            if params["query"].startswith("nid:"):
+                note_ids = {int(n) for n in params["query"][4:].split(",")}
+                return [c for c, n, _ in CARDS if n in note_ids]
+            return [c for c, _, d in CARDS if _matches(params["query"], d)]
+        if action == "cardsInfo":
+            return [
+                {
+                    "cardId": c,
+                    "note": n,
+                    "fields": {"Front": {"value": f"word {n}"}},
+                    "interval": c % 10,
+                }
+                for c, n, _ in CARDS
+                if c in params["cards"]
+            ]
+        if action == "notesInfo":
+            notes_info = []
+            for n in params["notes"]:
+                note = {"noteId": n, "tags": [f"tag{n}"]}
+                if self.notes_info_cards:
+                    note["cards"] = [c for c, card_note, _ in CARDS if card_note == n]
+                notes_info.append(note)
+            return notes_info
+        raise AssertionError(f"Unexpected action {action}")
+
+
+def test_find_cards_with_red_flag_sorted_due_query():
+    """Test that dueQuery holds the day offset of each note's cards."""
+    cards = FakeAnkiConnect().find_cards_with_red_flag_sorted()
+
+    due_query = {card["cardId"]: card["dueQuery"] for card in cards}
+    assert due_query == {11: 3, 12: 3, 21: 29, 31: -1, 41: -2, 51: 90, 61: 13}
+    assert [card["cardId"] for card in cards][:3] == [41, 31, 11]
+
+
+def test_find_cards_with_red_flag_note_content():
+    """Test that cards carry their note's fields and tags and their interval."""
+    cards = FakeAnkiConnect().find_cards_with_red_flag()
+
+    card = next(card for card in cards if card["cardId"] == 21)
+    assert card["noteFields"] == {"Front": {"value": "word 2"}}
+    assert card["noteTags"] == ["tag2"]
+    assert card["interval"] == 1
+
+
+def test_card_ids_without_notes_info_cards():
+    """Test that cards are found with nid: when notesInfo has no cards field."""
+    anki = FakeAnkiConnect()
+    anki.notes_info_cards = False
+
+    cards = anki.find_cards_with_red_flag_sorted()
+    assert len(cards) == len(CARDS)
+    assert anki.find_notes_with_red_flag()
+    assert "nid:1,2,3,4,5,6" in anki.queries
@@ -1,189 +1,216 @@
 """Tests for the CLI module."""
 
 import os
-import sys
-import tempfile
-from pathlib import Path
-from unittest.mock import MagicMock, patch
+import re
+from datetime import date
+from types import SimpleNamespace
+from unittest.mock import MagicMock, create_autospec, patch
 
+import pytest
 from click.testing import CliRunner
 
-# Add the src directory to the Python path
-sys.path.insert(
-    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
-)
+from anki_helpers.anki_connect import AnkiConnect
+from anki_helpers.cli import clean_html_content, cli, load_dotenv
+from anki_helpers.prompts.examples_for_red_cards import SYSTEM_MESSAGE, get_prompt
 
-from anki_helpers.cli import cli  # noqa: E402
+# Resolved once so tests can invoke it without dispatching through the group
+GET_EXAMPLES = cli.commands["get-examples-for-red-flags-cards"]
 
+# Matches input files listing the first two test words, in order
+_WORDS_12 = re.compile(r"test word 1.*test word 2", re.S)
 
-# Mock OpenAI class
-class OpenAI:
-    """Mock implementation of the OpenAI client for testing."""
+# Text streamed by the mocked OpenAI API, one chunk per part
+MOCK_RESPONSE_PARTS = (
+    "This is a mock response from OpenAI API. ",
+    "Please install the openai package to get actual responses.",
+)
 
-    def __init__(self, api_key=None):
-        """Initialize mock OpenAI client with API key.
+_MOCK_RESPONSE = [
+    SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=part))])
+    for part in MOCK_RESPONSE_PARTS
+]
+
+# Stand-in for the OpenAI client, returned instead of constructing one.
+# create records its arguments so tests can check the request.
+_OPENAI_SINGLETON = SimpleNamespace(
+    chat=SimpleNamespace(
+        completions=SimpleNamespace(create=MagicMock(return_value=_MOCK_RESPONSE))
+    )
+)
 
-        Args:
-            api_key: Optional API key for authentication
-        """
-        self.api_key = api_key
-        self.chat = ChatCompletions(api_key)
 
+@pytest.fixture(scope="module")
+def make_cards():
+    """Provide a factory building red flag cards for the mocked AnkiConnect."""
 
-class ChatCompletions:
-    """Mock implementation of the ChatCompletions API."""
+    def _make(n):
+        return [
+            {"noteFields": {"Front": {"value": f"test word {i + 1}"}}} for i in range(n)
+        ]
 
-    def __init__(self, api_key=None):
-        """Initialize mock ChatCompletions with API key.
+    return _make
 
-        Args:
-            api_key: Optional API key for authentication
-        """
-        self.api_key = api_key
-        self.completions = self
 
-    def create(self, model=None, messages=None):
-        """Mock the create method that generates completions.
+@pytest.fixture(scope="module")
+def red_flag_cards(make_cards):
+    """Provide the red flag cards returned by the mocked AnkiConnect."""
+    return make_cards(3)
 
-        Args:
-            model: Model name to use for generation
-            messages: List of message objects
-
-        Returns:
-            MockResponse object with test content
-        """
-        print(f"Would call OpenAI API with model {model} and {len(messages)} messages")
-        return MockResponse(
-            "This is a mock response from OpenAI API. Please install the openai package to get actual responses."
-        )
 
+@pytest.fixture(scope="module")
+def anki_template():
+    """Build the autospecced AnkiConnect mock once for the module."""
+    return create_autospec(AnkiConnect, instance=True)
 
-class MockResponse:
-    """Mock response object returned by the OpenAI API."""
 
-    def __init__(self, content):
-        """Initialize mock response with content.
-
-        Args:
-            content: Text content for the response
-        """
-        self.choices = [MockChoice(content)]
+@pytest.fixture
+def patched_cli(monkeypatch, anki_template):
+    """Replace AnkiConnect, OpenAI and the API key used by the CLI.
 
+    Args:
+        monkeypatch: Pytest fixture for patching attributes
+        anki_template: Autospecced AnkiConnect mock shared by the module
 
-class MockChoice:
-    """Mock choice object contained in API responses."""
+    Returns:
+        The mocked AnkiConnect instance the commands will use
+    """
+    # Reset rather than copy the template: copies share their child mocks,
+    # so return values and calls would leak between tests
+    mock_anki = anki_template
+    mock_anki.reset_mock(return_value=True, side_effect=True)
+    monkeypatch.setattr("anki_helpers.cli.AnkiConnect", lambda: mock_anki)
+    _OPENAI_SINGLETON.chat.completions.create.reset_mock()
+    monkeypatch.setattr("openai.OpenAI", lambda api_key=None: _OPENAI_SINGLETON)
+    monkeypatch.setenv("API_KEY", "test_api_key")
+    return mock_anki
+
+
+def test_clean_html_content():
+    """Test that HTML, entities and sound tags are stripped from card content."""
+    content = "<div>talo&nbsp;&amp; <b>koti</b></div> [sound:talo.mp3]&nbsp;"
+    assert clean_html_content(content) == "talo & koti"
+    assert clean_html_content("  plain   word ") == "plain word"
+
+
+@patch.dict("os.environ", {"EXISTING": "kept"})
+def test_load_dotenv(tmp_path, monkeypatch):
+    """Test that .env values are loaded without overriding the environment."""
+    monkeypatch.delenv("API_KEY", raising=False)
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / ".env").write_text(
+        'API_KEY = "secret=value"\n  # COMMENTED=1\n\nBROKEN\nEXISTING=new\n'
+    )
+    load_dotenv()
+
+    assert os.environ["API_KEY"] == "secret=value"
+    assert "COMMENTED" not in os.environ
+    assert "# COMMENTED" not in os.environ
+    assert os.environ["EXISTING"] == "kept"
+
+
+class TestCli:
+    """Tests for the CLI commands, sharing one Click runner."""
+
+    @pytest.fixture(scope="class")
+    @classmethod
+    def runner(cls):
+        """Provide a Click test runner shared by the tests in this class."""
+        return CliRunner()
+
+    def test_version(self, runner):
+        """Test the version command."""
+        result = runner.invoke(cli, ["version"], catch_exceptions=False)
+        assert result.exit_code == 0
+        assert "Anki Helpers version" in result.output
 
-    def __init__(self, content):
-        """Initialize mock choice with content.
+    def test_list_deck(self, patched_cli, runner):
+        """Test that list_deck prints the decks in alphabetical order.
 
         Args:
-            content: Text content for the message
+            patched_cli: Mocked AnkiConnect instance
+            runner: Click test runner
         """
-        self.message = MockMessage(content)
+        patched_cli.get_deck_names.return_value = ["Suomi", "Default"]
 
+        result = runner.invoke(cli, ["list-deck"], catch_exceptions=False)
 
-class MockMessage:
-    """Mock message object within a choice."""
+        assert result.exit_code == 0
+        assert result.output == "Available decks:\n  • Default\n  • Suomi\n"
 
-    def __init__(self, content):
-        """Initialize mock message with content.
+    def test_list_red_flags(self, patched_cli, runner):
+        """Test that list_red_flags shows the first cards in the order returned.
 
         Args:
-            content: Text content of the message
+            patched_cli: Mocked AnkiConnect instance
+            runner: Click test runner
         """
-        self.content = content
-
-
-def test_version():
-    """Test the version command."""
-    runner = CliRunner()
-    result = runner.invoke(cli, ["version"])
-    assert result.exit_code == 0
-    assert "Anki Helpers version" in result.output
-
-
-@patch("anki_helpers.cli.AnkiConnect")
-@patch("anki_helpers.cli.OpenAI", OpenAI)
-@patch.dict("os.environ", {"API_KEY": "test_api_key"})
-def test_get_examples_for_red_flags_cards(mock_anki_connect):
-    """Test the get_examples_for_red_flags_cards command.
+        patched_cli.find_cards_with_red_flag_sorted.return_value = [
+            {"noteFields": {"Front": {"value": "overdue"}}, "dueQuery": -2},
+            {"noteFields": {"Front": {"value": "<b>today</b>"}}, "dueQuery": 0},
+            {"noteFields": {"Front": {"value": "later"}}, "dueQuery": 90},
+        ]
 
-    This test verifies that the command correctly:
-    1. Retrieves red-flagged cards from Anki
-    2. Creates input-words.md file with card content
-    3. Calls OpenAI API to generate examples
-    4. Writes results to results.md file
-
-    Args:
-        mock_anki_connect: Mocked AnkiConnect class
-    """
-    """Test the get_examples_for_red_flags_cards command."""
-    # Setup mock AnkiConnect
-    mock_anki = MagicMock()
-    mock_anki_connect.return_value = mock_anki
-
-    # Mock the find_cards_with_red_flag_sorted method to return some test cards
-    mock_anki.find_cards_with_red_flag_sorted.return_value = [
-        {
-            "noteFields": {
-                "Front": {"value": "test word 1"},
-            }
-        },
-        {
-            "noteFields": {
-                "Front": {"value": "test word 2"},
-            }
-        },
-        {
-            "noteFields": {
-                "Front": {"value": "test word 3"},
-            }
-        },
-    ]
-
-    # Test case 1: Without limit (default behavior)
-    with tempfile.TemporaryDirectory() as temp_dir:
-        runner = CliRunner()
-        result = runner.invoke(cli, ["get-examples-for-red-flags-cards", temp_dir])
+        result = runner.invoke(
+            cli, ["list-red-flags", "--limit", "2"], catch_exceptions=False
+        )
 
-        # Check that the command executed successfully
         assert result.exit_code == 0
+        assert result.output.index("overdue") < result.output.index("today")
+        assert "later" not in result.output
+        assert f"Due: {date.today().isoformat()}" in result.output
+
+    @pytest.mark.parametrize(
+        "extra_args, expect_word3", [([], True), (["--limit", "2"], False)]
+    )
+    def test_get_examples_for_red_flags_cards(
+        self, patched_cli, runner, red_flag_cards, tmp_path, extra_args, expect_word3
+    ):
+        """Test the get_examples_for_red_flags_cards command.
+
+        This test verifies that the command correctly:
+        1. Retrieves red-flagged cards from Anki
+        2. Creates input-words.md file with card content, honouring --limit
+        3. Calls OpenAI API to generate examples
+        4. Writes results to results.md file
 
-        # Check that the input file was created
-        input_file_path = Path(temp_dir) / "input-words.md"
-        assert input_file_path.exists()
-
-        # Check that the results file was created
-        results_file_path = Path(temp_dir) / "results.md"
-        assert results_file_path.exists()
+        Args:
+            patched_cli: Mocked AnkiConnect instance
+            runner: Click test runner
+            red_flag_cards: Cards returned by the mocked AnkiConnect
+            tmp_path: Temporary directory for the output files
+            extra_args: Extra command line arguments for the command
+            expect_word3: Whether the third card should be processed
+        """
+        # Mock the find_cards_with_red_flag_sorted method to return some test cards
+        patched_cli.find_cards_with_red_flag_sorted.return_value = red_flag_cards
 
-        # Check the content of the input file
-        with open(input_file_path, "r") as f:
-            content = f.read()
-            assert "test word 1" in content
-            assert "test word 2" in content
-            assert "test word 3" in content
-
-    # Test case 2: With limit parameter
-    with tempfile.TemporaryDirectory() as temp_dir:
-        runner = CliRunner()
         result = runner.invoke(
-            cli, ["get-examples-for-red-flags-cards", "--limit", "2", temp_dir]
+            GET_EXAMPLES, [*extra_args, str(tmp_path)], catch_exceptions=False
         )
 
         # Check that the command executed successfully
         assert result.exit_code == 0
+        patched_cli.find_cards_with_red_flag_sorted.assert_called_once_with()
 
-        # Check that the input file was created
-        input_file_path = Path(temp_dir) / "input-words.md"
-        assert input_file_path.exists()
+        # Check that the input and results files were created
+        assert os.path.isfile(os.path.join(tmp_path, "input-words.md"))
+        assert os.path.isfile(os.path.join(tmp_path, "results.md"))
+
+        # Check the content of the results file
+        results = (tmp_path / "results.md").read_text()
+        assert results == "".join(MOCK_RESPONSE_PARTS)
 
         # Check the content of the input file
-        with open(input_file_path, "r") as f:
-            content = f.read()
-            assert "test word 1" in content
-            assert "test word 2" in content
-            assert "test word 3" not in content
-
-    # Check that the mock was called
-    assert mock_anki.find_cards_with_red_flag_sorted.call_count == 2
+        content = (tmp_path / "input-words.md").read_text()
+        assert _WORDS_12.search(content)
+        assert ("test word 3" in content) is expect_word3
+
+        # Check that the response was requested as a stream for these words
+        _OPENAI_SINGLETON.chat.completions.create.assert_called_once_with(
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": SYSTEM_MESSAGE},
+                {"role": "user", "content": get_prompt(content)},
+            ],
+            stream=True,
+        )